@@ -12,18 +12,30 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from common import error
+from common import error, yaml_safe_loader
 
 from dataclasses import dataclass, field
 from typing import Dict, Any
 from types import NoneType
 
 import re
-import yaml
 import dacite
 
 
-@dataclass
+variable_group = re.compile(r"\$\{\{([\sa-zA-Z0-9_\-]*)\}\}")
+
+# YAML keys that differ from the corresponding dataclass field names
+command_field_names = {
+    "check-exit-code": "check_exit_code",
+    "should-fail": "should_fail",
+}
+
+task_field_names = command_field_names | {
+    "fail-fast": "fail_fast",
+}
+
+
+@dataclass(slots=True)
 class Command:
     """
     Stores a Shell command with custom configuration options
@@ -36,33 +48,21 @@ class Command:
     check_exit_code: bool | NoneType = None
     should_fail: bool | NoneType = None
 
-    def __getitem__(self, item):
-        return getattr(self, item)
-
-    def __setitem__(self, key, item):
-        setattr(self, key, item)
-
     def _apply_task_properties(self, keys: list[str], defaults: list[Any], task_values: list[Any]):
 
-        for it, key in enumerate(keys):
-            self[key] = task_values[it]       \
-                if self[key] == defaults[it]  \
-                else self[key]
+        for key, default, task_value in zip(keys, defaults, task_values):
+            if getattr(self, key) == default:
+                setattr(self, key, task_value)
 
     @staticmethod
     def load_from_dict(dict: Dict[str, Any] | str):
 
-        if type(dict) == str:
-            dict = {"command": dict}
+        if isinstance(dict, str):
+            return Command(command=dict)
         elif not dict.get("command"):
             dict["command"] = ""
 
-        name_map = {name: name for name in dict.keys()} | {
-            "check-exit-code": "check_exit_code",
-            "should-fail": "should_fail",
-        }
-
-        return dacite.from_dict(data_class=Command, data={name_map[name]: value for name, value in dict.items()})
+        return dacite.from_dict(data_class=Command, data={command_field_names.get(name, name): value for name, value in dict.items()})
 
     def apply_vars(self, vars: Dict[str, str]):
         """
@@ -73,19 +73,22 @@ class Command:
         vars : dictionary with pairs: name, value
         """
 
-        variable_group = r"\$\{\{([\sa-zA-Z0-9_\-]*)\}\}"
+        # most commands have no variables, a substring check is much cheaper than the regex
+        if "${{" not in self.command:
+            return
 
-        for match in re.finditer(variable_group, self.command):
-            pattern = match[0]
+        def resolve(match: re.Match) -> str:
             var_name = match[1]
 
-            if var_name in vars:
-                self.command = self.command.replace(pattern, vars[var_name])
-            else:
+            if var_name not in vars:
                 error(f"Variable {var_name} not found!")
 
+            return vars[var_name]
+
+        self.command = variable_group.sub(resolve, self.command)
+
 
-@dataclass
+@dataclass(slots=True)
 class Task:
     """
     A Task is a block of commands that are performed on one shell and have
@@ -118,36 +121,47 @@ class Task:
         ----------
         default_vars : global variables dictionary
         """
+        vars = default_vars | self.vars | override_variables
+
         for command in self.commands:
-            command.apply_vars(default_vars | self.vars | override_variables)
+            command.apply_vars(vars)
 
     @staticmethod
     def load_from_dict(dict: Dict[str, Any]) -> 'Task':
 
-        name_map = {name: name for name in dict.keys()} | {
-            "fail-fast": "fail_fast",
-            "check-exit-code": "check_exit_code",
-            "should-fail": "should_fail",
-        }
-
-        return dacite.from_dict(data_class=Task, data={name_map[name]: value for name, value in dict.items()})
+        return dacite.from_dict(data_class=Task, data={task_field_names.get(name, name): value for name, value in dict.items()})
 
     @staticmethod
-    def load_from_yaml(yaml_string: str, overrides: Dict[str, Any] = {}) -> 'Task':
+    def parse_yaml(yaml_string: str) -> Dict[str, Any]:
         """
-        Construct a Task from YAML.
+        Parse YAML Task description without constructing the Task.
 
         Parameters
         ----------
         yaml_string : string with YAML
-        overrides: additional overrides for Task parameters
         """
 
-        obj: Dict[str, Any] = yaml.safe_load(yaml_string)
-        if type(obj) is not dict:
+        # yaml is imported here, because Tasks loaded from the JSON cache do not need it
+        import yaml
+
+        obj: Dict[str, Any] = yaml.load(yaml_string, Loader=yaml_safe_loader())
+        if not isinstance(obj, dict):
             raise yaml.YAMLError
 
-        obj.update(overrides)
+        return obj
+
+    @staticmethod
+    def load_from_object(obj: Dict[str, Any], overrides: Dict[str, Any] = {}) -> 'Task':
+        """
+        Construct a Task from a parsed YAML or JSON description.
+
+        Parameters
+        ----------
+        obj : Task description
+        overrides: additional overrides for Task parameters
+        """
+
+        obj = obj | overrides
 
         if "name" not in obj.keys():
             error("Task description file must at least contain a 'name' field")
@@ -159,6 +173,19 @@ class Task:
 
         return Task.load_from_dict(obj)
 
+    @staticmethod
+    def load_from_yaml(yaml_string: str, overrides: Dict[str, Any] = {}) -> 'Task':
+        """
+        Construct a Task from YAML.
+
+        Parameters
+        ----------
+        yaml_string : string with YAML
+        overrides: additional overrides for Task parameters
+        """
+
+        return Task.load_from_object(Task.parse_yaml(yaml_string), overrides)
+
     @staticmethod
     def from_multiline_string(name: str, string: str, params: Dict[str, Any]) -> 'Task':
         """
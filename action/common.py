@@ -13,6 +13,7 @@
 # limitations under the License.
 
 from dataclasses import dataclass
+from functools import cache
 from urllib.parse import urlparse
 from typing import Dict
 
@@ -20,8 +21,8 @@ import os
 import re
 import sys
 import shutil
+import hashlib
 import requests
-import pexpect as px
 
 
 @dataclass
@@ -32,6 +33,9 @@ class Architecture:
     network_available: bool
 
 
+# files downloaded by get_file with use_cache enabled
+file_cache = os.path.expanduser("~/.cache/renode-linux-runner-action/files")
+
 archs: Dict[str, Architecture] = {
     "riscv64": Architecture(
         python_name="riscv64",
@@ -48,6 +52,13 @@ archs: Dict[str, Architecture] = {
 }
 
 
+def is_literal(pattern: str) -> bool:
+    """
+    Check if the regex pattern contains no special characters and matches only itself
+    """
+    return not any(c in ".^$*+?{}[]\\|()" for c in pattern)
+
+
 class FilteredStdout(object):
     """
     Stdout wrapper which replaces found pattern with 'replace' string.
@@ -64,8 +75,16 @@ class FilteredStdout(object):
         self.pattern = re.compile(pattern)
         self.replace = replace
 
+        # A single literal character can be replaced with str.replace,
+        # which is much faster than a regex substitution
+        self.literal = len(pattern) == 1 and is_literal(pattern)
+        self.pattern_str = pattern
+
     def _write(self, string):
-        self.stream.write(re.sub(self.pattern, self.replace, string))
+        if self.literal:
+            self.stream.write(string.replace(self.pattern_str, self.replace))
+        else:
+            self.stream.write(self.pattern.sub(self.replace, string))
 
     def __getattr__(self, attr):
         if attr == 'write':
@@ -73,6 +92,21 @@ class FilteredStdout(object):
         return getattr(self.stream, attr)
 
 
+@cache
+def yaml_safe_loader():
+    """
+    Returns the libyaml based YAML SafeLoader, or the pure Python one
+    with a warning if PyYAML was built without libyaml
+    """
+    try:
+        from yaml import CSafeLoader as SafeLoader
+    except ImportError:
+        print("WARNING: PyYAML was built without libyaml, YAML files will be loaded with the slower pure Python loader")
+        from yaml import SafeLoader
+
+    return SafeLoader
+
+
 def error(msg: str):
     """
     Print message and exit with error code 1
@@ -85,34 +119,6 @@ def error(msg: str):
     sys.exit(1)
 
 
-def run_cmd(child_process: px.spawn,
-            output_to_expect: str,
-            cmd_to_run: str,
-            timeout: int = -1):
-    """
-    Wait for expected output in process spawned using pexpect and then run specified command
-
-    Parameters
-    ----------
-    child_process : pexpect.spawn
-        The process spawned using pexpect
-    output_to_expect : str
-        The output for that pexpect should wait before sending the specified command
-    cmd_to_run : str
-        The commands that should be run in child process after the expected output appears
-    timeout : int
-        Maximum time for waiting for expected output (default: -1 - which means inheriting timeout from specified child process)
-
-    Raises
-    ------
-    pexpect.TIMEOUT
-        If waiting for the expected output timeouts
-    """
-
-    child_process.expect_exact(output_to_expect, timeout=timeout)
-    child_process.sendline(cmd_to_run)
-
-
 def is_url(url):
     """
     Check if provided parameter is valid URL
@@ -124,7 +130,7 @@ def is_url(url):
         return False
 
 
-def get_file(path_or_url: str, target_path: str):
+def get_file(path_or_url: str, target_path: str, use_cache: bool = False):
     """
     File downloader. Download the file from provide URL as filename
     or copy the file from path to filename.
@@ -133,21 +139,49 @@ def get_file(path_or_url: str, target_path: str):
         URL or path to the file
     target_path: str
         target path where you want to copy the file
+    use_cache: bool
+        keep the downloaded file in `file_cache` and download it again only if
+        the server reports a different ETag
     """
 
-    if target_path.find('/') != -1:
-        os.makedirs("/".join(target_path.split("/")[:-1]), exist_ok=True)
+    target_directory = os.path.dirname(target_path)
+    if target_directory:
+        os.makedirs(target_directory, exist_ok=True)
 
     if os.path.isfile(path_or_url):
         shutil.move(path_or_url, target_path)
     elif is_url(path_or_url):
+        cache_path = os.path.join(file_cache, hashlib.sha256(path_or_url.encode()).hexdigest())
+        headers = {}
+
+        if use_cache and os.path.exists(cache_path) and os.path.exists(f"{cache_path}.etag"):
+            with open(f"{cache_path}.etag") as etag_file:
+                headers["If-None-Match"] = etag_file.read()
+
         try:
-            r = requests.get(path_or_url)
-            r.raise_for_status()
+            with requests.get(path_or_url, stream=True, headers=headers) as r:
+                r.raise_for_status()
+
+                if r.status_code == 304:
+                    shutil.copyfile(cache_path, target_path)
+                    return
+
+                with open(target_path, "wb") as fd:
+                    for chunk in r.iter_content(chunk_size=1024**2):
+                        fd.write(chunk)
+
+                etag = r.headers.get("ETag")
         except (requests.exceptions.MissingSchema, requests.RequestException, requests.HTTPError) as err:
             error(f"Error while downloading {path_or_url} {err.response}")
-        finally:
-            with open(target_path, "wb") as fd:
-                fd.write(r.content)
+
+        if use_cache and etag is not None:
+            try:
+                os.makedirs(file_cache, exist_ok=True)
+                shutil.copyfile(target_path, cache_path)
+                with open(f"{cache_path}.etag", "w") as etag_file:
+                    etag_file.write(etag)
+            except OSError:
+                # the cache is only an optimization
+                pass
     else:
         error(f"Invalid path or URL: {path_or_url}")
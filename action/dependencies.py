@@ -12,15 +12,20 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from common import run_cmd, error, archs
+from common import error, archs
 from images import shared_directories_action, shared_directories_actions
 
-from typing import Dict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from subprocess import run, TimeoutExpired
+from typing import Any, Dict
+from time import time
 
 import os
 import re
+import sys
 import json
-import pexpect as px
+import hashlib
 
 
 # names of python packages that is used to install other packages
@@ -28,33 +33,138 @@ import pexpect as px
 # choose at least one regular package
 installation_dependencies = ["wheel"]
 
+# pip from the virtual environment prepared by the action, called directly
+# instead of activating the environment in a shell
+pip_executable = "venv-dir/bin/pip"
+pip_version = "23.0.1"
 
-def get_package(child: px.spawn, arch: str, package_name: str) -> list[str]:
+# strange ASCII control codes that appear during some 'pip download' runs
+ansi_escape = re.compile(r'\x1B[@-_][0-?]*[ -/]*[@-~]')
+
+# 'pip download' reports downloaded files with one of these messages
+pip_saved_prefixes = ("Saved ", "File was already downloaded ")
+
+# pip installation reports of pinned packages are cached here, unpinned dependencies
+# of pinned packages still change over time, so the cached reports expire after a day
+resolve_cache = os.path.expanduser("~/.cache/renode-linux-runner-action/resolve")
+resolve_cache_lifetime = 24 * 60 * 60
+
+# packages pinned to a single version, or VCS urls pinned to a full commit hash
+pinned_package = re.compile(r"[\w.-]+(\[[\w.,-]*\])?==[\w.+!-]+|([\w.-]+ @ )?\w+\+\S+@([0-9a-f]{40}|[0-9a-f]{64})")
+
+
+def get_package(arch: str, package_names: list[str], cache_dir: str) -> list[str]:
     """
-    Download selected python package for specified platform.
+    Download selected python packages for specified platform with a single pip call
+    to the pip directory.
 
     Parameters
     ----------
-    child: px_spawn
-        pexpect spawn with shell and python virtual environment enabled
     arch: str
         binaries architecture
+    package_names: list[str]
+        packages to download
+    cache_dir: str
+        pip cache directory, files found there are not downloaded again
+    """
+
+    if package_names == []:
+        return []
+
+    result = run(
+        [pip_executable, "download", *package_names, f"--platform=linux_{archs[arch].python_name}", "--no-deps", "--dest", "pip", "--cache-dir", cache_dir, "--progress-bar", "off", "--disable-pip-version-check"],
+        capture_output=True,
+        text=True
+    )
+
+    if result.returncode != 0:
+        # pip aborts the whole call if any package cannot be downloaded,
+        # so the packages are retried one by one to download the rest of them
+        if len(package_names) > 1:
+            return list(chain.from_iterable(get_package(arch, [package_name], cache_dir) for package_name in package_names))
+
+        print(f"WARNING: Could not download {package_names[0]}:\n{result.stderr}")
+        return []
+
+    output_str: str = ansi_escape.sub('', result.stdout)
+
+    lines = [line.strip() for line in output_str.splitlines()]
+
+    # files that are already in the pip directory, e.g. on reruns, are not saved again
+    return [os.path.basename(line.removeprefix(prefix)) for line in lines for prefix in pip_saved_prefixes if line.startswith(prefix)]
+
+
+def get_report(package: str) -> Dict[str, Any]:
+    """
+    Resolve dependencies of the package with pip's installation report. Reports of pinned packages
+    are cached on disk for `resolve_cache_lifetime` seconds, so reruns with the same packages skip resolution.
+
+    Parameters
+    ----------
+    package: str
+        package, as specified by the user
+    """
+
+    # unpinned packages, e.g. a branch of a repository, may resolve to something else on every run
+    cacheable = pinned_package.fullmatch(package.strip()) is not None
+
+    cache_key = hashlib.sha256(f"{package}|{pip_version}|{sys.version_info[:2]}".encode()).hexdigest()
+    cache_path = os.path.join(resolve_cache, f"{cache_key}.json")
+
+    if cacheable and os.path.exists(cache_path) and time() - os.path.getmtime(cache_path) < resolve_cache_lifetime:
+        with open(cache_path, "r", encoding="utf-8") as report_file:
+            return json.load(report_file)
+
+    # the report is written to stdout, -q keeps other pip messages out of it
+    result = run(
+        [pip_executable, "install", "-q", *package.split(), "--dry-run", "--report", "-", "--progress-bar", "off", "--disable-pip-version-check"],
+        capture_output=True,
+        text=True
+    )
+
+    try:
+        report = json.loads(result.stdout)
+    except json.JSONDecodeError:
+        error("Could not load the pip report, the error is most likely caused by a service outage")
+
+    if not cacheable:
+        return report
+
+    try:
+        os.makedirs(resolve_cache, exist_ok=True)
+        with open(cache_path, "w", encoding="utf-8") as report_file:
+            report_file.write(result.stdout)
+    except OSError:
+        # the cache is only an optimization
+        pass
+
+    return report
+
+
+def add_to_batch(batches: list[Dict[str, str]], project: str, package_name: str):
+    """
+    Add the package to the first batch without another version of the same project,
+    because pip cannot download two versions of one project in a single call.
+
+    Parameters
+    ----------
+    batches: list[Dict[str, str]]
+        batches of packages to download, each maps project names to package names
+    project: str
+        name of the project, to which the package belongs
     package_name: str
         package to download
     """
 
-    child.sendline('')
-    run_cmd(child, "(venv-dir) #", f"pip download {package_name} --platform=linux_{archs[arch].python_name} --no-deps --progress-bar off --disable-pip-version-check")
-    child.expect_exact('(venv-dir) #')
-
-    # Removes strange ASCII control codes that appear during some 'pip download' runs.
-    ansi_escape = re.compile(r'\x1B[@-_][0-?]*[ -/]*[@-~]')
-    output_str: str = ansi_escape.sub('', child.before)
+    for batch in batches:
+        if project not in batch:
+            batch[project] = package_name
+            return
 
-    return [file.split(' ')[1].split('/')[1] for file in output_str.splitlines() if file.startswith('Saved')]
+    batches.append({project: package_name})
 
 
-def get_packages(arch: str, packages: str) -> tuple[list[str], list[str]]:
+def get_packages(arch: str, packages: str, cache_dir: str) -> tuple[list[str], list[str]]:
     """
     Download all selected python packages and their dependencies
     for the specified architecture to sideload it later to emulated Linux.
@@ -64,24 +174,28 @@ def get_packages(arch: str, packages: str) -> tuple[list[str], list[str]]:
         binaries architecture
     packages: str
         raw string from github action, syntax defined in README.md
+    cache_dir: str
+        pip cache directory, can be preserved between workflow runs
     """
 
     if packages.strip() == '':
         return [], []
 
-    # python installation dependencies files ready to sideload
-    downloaded_installation_dependencies = []
-
-    # python packages files ready to sideload
-    downloaded_packages = []
+    # resolved dependencies to download, split into batches downloaded with one pip call each
+    installation_dependencies_to_download: list[Dict[str, str]] = []
+    packages_to_download: list[Dict[str, str]] = []
+    queued_downloads = set()
 
-    child = px.spawn(f'sh -c "cd {os.getcwd()};exec /bin/sh"', encoding="utf-8", timeout=60)
+    # pip running as root disables a cache directory that is not owned by root, so the directory
+    # is owned by root during the downloads and returned to the owner of the workspace afterwards,
+    # otherwise it could not be saved by the runner user, e.g. with actions/cache
+    cache_owner = os.stat(os.path.dirname(os.path.abspath(cache_dir)))
+    os.makedirs(cache_dir, exist_ok=True)
+    if os.geteuid() == 0:
+        os.chown(cache_dir, 0, 0)
 
     try:
-        child.expect_exact('#')
-        child.sendline('')
-
-        run_cmd(child, "#", "mkdir -p pip")
+        os.makedirs("pip", exist_ok=True)
         shared_directories_actions.append(
             shared_directories_action(
                 f"{os.getcwd()}/pip",
@@ -89,25 +203,19 @@ def get_packages(arch: str, packages: str) -> tuple[list[str], list[str]]:
             )
         )
 
-        run_cmd(child, "#", ". ./venv-dir/bin/activate")
-
         # Since the pip version in Ubuntu 22.04 is 22.0.2 and the first stable pip that supporting the --report flag is 23.0,
         # pip needs to be updated in venv. This workaround may be removed later.
-        run_cmd(child, "(venv-dir) #", "pip -q install pip==23.0.1 --progress-bar off --disable-pip-version-check")
+        run([pip_executable, "-q", "install", f"pip=={pip_version}", "--progress-bar", "off", "--disable-pip-version-check"], capture_output=True)
 
-        for it, package in enumerate(installation_dependencies + packages.splitlines()):
+        package_list = installation_dependencies + packages.splitlines()
 
-            print(f"processing: {package}")
+        # packages are resolved independently of each other, so all of them are resolved concurrently
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            reports = list(executor.map(get_report, package_list))
 
-            # prepare report
-            run_cmd(child, "(venv-dir) #", f"pip install -q {package} --dry-run --report report.json --progress-bar off --disable-pip-version-check")
-            child.expect_exact("(venv-dir)")
+        for it, (package, report) in enumerate(zip(package_list, reports)):
 
-            try:
-                with open("report.json", "r", encoding="utf-8") as report_file:
-                    report = json.loads(report_file.read())
-            except FileNotFoundError:
-                error("Could not load the report.json file, the error is most likely caused by a service outage")
+            print(f"processing: {package}")
 
             print(f"Packages to install: {len(report['install'])}")
 
@@ -116,25 +224,57 @@ def get_packages(arch: str, packages: str) -> tuple[list[str], list[str]]:
                 dependency_name = dependency["metadata"]["name"] + "==" + dependency["metadata"]["version"] \
                     if "vcs_info" not in dependency["download_info"] \
                     else "git+" + dependency["download_info"]["url"] + "@" + dependency["download_info"]["vcs_info"]["commit_id"]
-                if it < len(installation_dependencies):
-                    downloaded_installation_dependencies += get_package(child, arch, dependency_name)
-                else:
-                    downloaded_packages += get_package(child, arch, dependency_name)
 
-            child.sendline('')
+                # each file is downloaded only once, so concurrent downloads never write the same file
+                if dependency_name in queued_downloads:
+                    continue
 
-        run_cmd(child, "(venv-dir) #", "deactivate")
+                queued_downloads.add(dependency_name)
 
-        for package in downloaded_installation_dependencies + downloaded_packages:
-            run_cmd(child, "#", f"mv {package} pip")
+                add_to_batch(
+                    installation_dependencies_to_download if it < len(installation_dependencies) else packages_to_download,
+                    dependency["metadata"]["name"].lower(),
+                    dependency_name
+                )
 
-        child.expect_exact("#")
-    except px.TIMEOUT:
-        error("Timeout!")
+        # all dependencies are known at this point, so all batches are downloaded concurrently
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            downloaded_installation_dependencies = executor.map(lambda batch: get_package(arch, list(batch.values()), cache_dir), installation_dependencies_to_download)
+            downloaded_packages = executor.map(lambda batch: get_package(arch, list(batch.values()), cache_dir), packages_to_download)
+
+            downloaded_installation_dependencies = list(chain.from_iterable(downloaded_installation_dependencies))
+            downloaded_packages = list(chain.from_iterable(downloaded_packages))
+
+    finally:
+        if os.geteuid() == 0:
+            run(["chown", "-R", f"{cache_owner.st_uid}:{cache_owner.st_gid}", cache_dir])
 
     return downloaded_installation_dependencies, downloaded_packages
 
 
+def clone_repo(repo: str, folder: str):
+    """
+    Clone a git repo to the repos directory.
+
+    Parameters
+    ----------
+    repo: str
+        url of the repo
+    folder: str
+        destination folder inside the repos directory
+    """
+
+    print(f'Cloning {repo}' + f' to {folder}' if folder != '' else '')
+
+    try:
+        result = run(["git", "clone", repo, f"repos/{folder}"], timeout=3600)
+    except TimeoutExpired:
+        error("Timeout!")
+
+    if result.returncode != 0:
+        error(f"Could not clone {repo}")
+
+
 def add_repos(repos: str):
     """
     Download all selected git repos to sideload it later to emulated Linux.
@@ -145,42 +285,59 @@ def add_repos(repos: str):
         raw string from github action, syntax defined in README.md
     """
 
-    os.mkdir("repos")
+    os.makedirs("repos", exist_ok=True)
+
+    repo_list: list[tuple[str, str]] = []
 
     for repo in repos.splitlines():
 
         repo = repo.split(' ')
-        repo, folder = repo[0], repo[1] if len(repo) > 1 else repo[0].split('/')[-1]
+        repo_list.append((repo[0], repo[1] if len(repo) > 1 else repo[0].split('/')[-1]))
 
-        print(f'Cloning {repo}' + f' to {folder}' if folder != '' else '')
+    if repo_list == []:
+        return
 
-        child = px.spawn(f'sh -c "cd {os.getcwd()};exec /bin/sh"', encoding="utf-8", timeout=10)
+    # clones are network-bound and independent of each other
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda repo: clone_repo(*repo), repo_list))
 
-        try:
-            child.expect_exact('#')
-            child.sendline('')
+    shared_directories_actions.append(
+        shared_directories_action(
+            f"{os.getcwd()}/repos",
+            "/home",
+        )
+    )
 
-            run_cmd(child, "#", f"git clone {repo} repos/{folder}")
 
-            child.expect_exact('#', timeout=3600)
-        except px.TIMEOUT:
-            error("Timeout!")
+def wheel_project(file_name: str) -> str:
+    """
+    Returns the normalized project name from the name of a wheel file.
 
-        shared_directories_actions.append(
-            shared_directories_action(
-                f"{os.getcwd()}/repos",
-                "/home",
-            )
-        )
+    Parameters
+    ----------
+    file_name: str
+        wheel file name, e.g. "typing_extensions-4.5.0-py3-none-any.whl"
+    """
 
+    return re.sub(r"[-_.]+", "-", file_name.split("-")[0]).lower()
 
-def add_packages(arch: str, packages: str) -> Dict[str, str]:
 
-    downloaded_installation_dependencies, downloaded_packages = get_packages(arch, packages)
+def add_packages(arch: str, packages: str, cache_dir: str) -> Dict[str, str]:
+
+    downloaded_installation_dependencies, downloaded_packages = get_packages(arch, packages, cache_dir)
 
     if downloaded_packages == []:
         return {}
 
+    # installation dependencies are only needed to build packages from sources,
+    # when there are none, all packages are installed with a single, slow in Renode, pip call,
+    # unless the user chose another version of an installation dependency, because
+    # pip cannot install two versions of one project at once
+    if all(package.endswith(".whl") for package in downloaded_packages) and \
+       {wheel_project(package) for package in downloaded_installation_dependencies}.isdisjoint(map(wheel_project, downloaded_packages)):
+        downloaded_packages = downloaded_installation_dependencies + downloaded_packages
+        downloaded_installation_dependencies = []
+
     return {
         "python": {
             "PYTHON_INSTALL_DEPS": " ".join([f'/var/packages/{package}' for package in downloaded_installation_dependencies]),
@@ -12,15 +12,20 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from common import error
+from common import error, yaml_safe_loader
 
 from typing import Protocol, Any, Dict, Tuple, Iterator
-from dataclasses import dataclass
-from string import hexdigits
+from dataclasses import dataclass, field
+from itertools import chain
 
+import re
 import yaml
 
 
+# a line with at most one word and without a colon
+device_without_params = re.compile(r"\s*[^\s:]*\s*")
+
+
 class Action(Protocol):
     """
     Called by the add_devices function. Used for some
@@ -53,19 +58,11 @@ class GPIO_SplitDevice:
     def __call__(self, args: list[str]) -> list[str]:
 
         assert len(args) == 2, "not enough parameters passed"
-        assert all(type(arg) is int for arg in args) or all(arg.isdecimal() for arg in args)
 
+        # the types are validated once in check_args
         l, r = int(args[0]), int(args[1])
-        gpio_ranges_params = []
-
-        while r - l > 32:
-            gpio_ranges_params += [l, l + 32]
-            l += 32
 
-        if l != r:
-            gpio_ranges_params += [l, r]
-
-        return [','.join([str(i) for i in gpio_ranges_params])]
+        return [','.join(f"{start},{min(start + 32, r)}" for start in range(l, r, 32))]
 
     def check_args(self, args: list[int | str]) -> bool:
 
@@ -74,12 +71,12 @@ class GPIO_SplitDevice:
 
         if type(args[0]) is int and type(args[1]) is int:
             return args[0] < args[1]
-        elif type(args[0]) is str and type(args[1]) is str:
-            return args[0].isdecimal() and \
-                   args[1].isdecimal() and \
-                   int(args[0]) < int(args[1])
-        else:
-            return False
+
+        # int() also accepts signs and whitespace
+        if type(args[0]) is str and type(args[1]) is str:
+            return args[0].isdecimal() and args[1].isdecimal() and int(args[0]) < int(args[1])
+
+        return False
 
 
 class I2C_SetDeviceAddress:
@@ -107,15 +104,21 @@ class I2C_SetDeviceAddress:
         if type(args[0]) is int:
             return 3 <= args[0] <= 119
         elif type(args[0]) is str:
-            return len(args[0]) >= 3 and \
-                   args[0][0:2] == '0x' and \
-                   all(c in hexdigits for c in args[0][2:]) and \
-                   3 <= int(args[0], 16) <= 119
+            digits = args[0][2:]
+
+            # int() also accepts signs, underscores and whitespace
+            if args[0][0:2] != '0x' or not (digits.isascii() and digits.isalnum()):
+                return False
+
+            try:
+                return 3 <= int(args[0], 16) <= 119
+            except ValueError:
+                return False
         else:
             return False
 
 
-@dataclass
+@dataclass(slots=True)
 class DevicePrototype:
     """
     Device Prototype: it stores available devices that can be added.
@@ -125,12 +128,23 @@ class DevicePrototype:
     command_action: list[Tuple[Action, list[str]]]
         defines number of parameters needed and the
         Action itself and their names (for yaml style list)
+    args_names: list[str]
+        names of all parameters in order, computed once
+        from command_action
+    params_list_upper: list[str]
+        params_list in upper case, used as variable names
     """
     params_list: list[str]
     command_action: list[Tuple[Action, list[str]]]
+    args_names: list[str] = field(init=False)
+    params_list_upper: list[str] = field(init=False)
+
+    def __post_init__(self):
+        self.args_names = list(chain.from_iterable(args[1] for args in self.command_action))
+        self.params_list_upper = [param.upper() for param in self.params_list]
 
 
-@dataclass
+@dataclass(slots=True)
 class Device:
     """
     Device with parameters selected by the user
@@ -154,11 +168,11 @@ available_devices: Dict[str, DevicePrototype] = {
             ),
     "gpio": DevicePrototype(
                 ["ranges"],
-                [(GPIO_SplitDevice, ["left-bound", "right-bound"])],
+                [(GPIO_SplitDevice(), ["left-bound", "right-bound"])],
             ),
     "i2c": DevicePrototype(
                 ["chip_addr"],
-                [(I2C_SetDeviceAddress, ["chip-addr"])],
+                [(I2C_SetDeviceAddress(), ["chip-addr"])],
     )
 }
 
@@ -177,7 +191,7 @@ def get_device(devices: str) -> Iterator[Device]:
         return suspect if suspect is not None else {}
 
     def add_colon_if_no_params(line: str) -> str:
-        return line if ":" in line or len(line.split()) > 1 else f"{line}:"
+        return f"{line}:" if device_without_params.fullmatch(line) else line
 
     def device_available(device: str) -> bool:
         if device not in available_devices:
@@ -188,16 +202,28 @@ def get_device(devices: str) -> Iterator[Device]:
     devices_dict: Dict[str, Dict[str, str]] = {}
 
     try:
-        devices_dict = {
-            device: none_to_empty_dict(args) for device, args in yaml.load(
-                str.join('\n', [add_colon_if_no_params(line) for line in devices.splitlines()]),
-                Loader=yaml.FullLoader
-            ).items() if device_available(device)
-        }
-
-        if any(type(args) is not dict for args in devices_dict.values()):
+        # a line with parameters and no colon is never a valid yaml style list,
+        # so the multiline string style is parsed without running the yaml parser
+        if ":" not in devices and any(len(line.split()) > 1 for line in devices.splitlines()):
+            raise yaml.YAMLError
+
+        parsed = yaml.load(
+            '\n'.join(add_colon_if_no_params(line) for line in devices.splitlines()),
+            Loader=yaml_safe_loader()
+        )
+
+        # the list is validated before any warning is printed,
+        # so the fallback below does not print them again
+        if type(parsed) is not dict or any(
+            type(none_to_empty_dict(args)) is not dict
+            for device, args in parsed.items() if device in available_devices
+        ):
             raise yaml.YAMLError
 
+        for device, args in parsed.items():
+            if device_available(device):
+                devices_dict[device] = none_to_empty_dict(args)
+
     except Exception:
 
         for device in devices.splitlines():
@@ -210,7 +236,7 @@ def get_device(devices: str) -> Iterator[Device]:
 
             device_prototype = available_devices[device_name]
 
-            if len(device_args) != sum([len(i[1]) for i in device_prototype.command_action]):
+            if len(device_args) != len(device_prototype.args_names):
                 print(f"WARNING: for device {device_name}, wrong number "
                       "of parameters, replaced with the default ones.")
 
@@ -218,21 +244,16 @@ def get_device(devices: str) -> Iterator[Device]:
                 continue
 
             devices_dict[device_name] = {
-                param: value for param, value in zip(
-                    sum([args[1] for args in available_devices[device_name].command_action], start=[]),
-                    device_args
-                )
+                param: value for param, value in zip(device_prototype.args_names, device_args)
             }
 
-    finally:
-
-        for device_name, device_args in devices_dict.items():
+    for device_name, device_args in devices_dict.items():
 
-            yield Device(
-                device_name,
-                available_devices[device_name],
-                device_args,
-            )
+        yield Device(
+            device_name,
+            available_devices[device_name],
+            device_args,
+        )
 
 
 def add_devices(devices: str) -> Dict[str, Dict[str, str]]:
@@ -253,7 +274,7 @@ def add_devices(devices: str) -> Dict[str, Dict[str, str]]:
 
         for params_hook in device.prototype.command_action:
 
-            params_action = params_hook[0]
+            params_action: Action = params_hook[0]
             params_list_len = len(params_hook[1])
             params = [device.args[arg] for arg in params_hook[1]]
 
@@ -265,8 +286,6 @@ def add_devices(devices: str) -> Dict[str, Dict[str, str]]:
 
             if params_list_len > 0 and params_action:
 
-                params_action: Action = params_action()
-
                 if not params_action.check_args(params):
                     error(f"ERROR: for device {device.name} {params_action.error}.")
 
@@ -277,7 +296,9 @@ def add_devices(devices: str) -> Dict[str, Dict[str, str]]:
                 variable_list = params
                 variable_list_len = params_list_len
 
-            new_device |= {device.prototype.params_list[i + vars_pointer].upper(): var for i, var in enumerate(variable_list)}
+            for i, var in enumerate(variable_list, start=vars_pointer):
+                new_device[device.prototype.params_list_upper[i]] = var
+
             vars_pointer += variable_list_len
 
         added_devices[f"device-{device.name}"] = new_device
@@ -16,15 +16,77 @@ from common import FilteredStdout, error
 from command import Command, Task
 from shell import Shell
 
-from typing import Dict, TextIO
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from collections import deque
+from typing import Dict, Iterator, TextIO
 from time import sleep
 
 import os
 import sys
-import igraph as ig
+import json
+import hashlib
+import tempfile
 
 
-CR = r'\r'
+CR = '\r'
+
+# Renode monitor prompt, e.g. "(monitor)" or "(machine-0)"
+RENODE_PROMPT = r"\([\-a-zA-Z\d\s]+\)"
+
+# Parsed Task files are cached as JSON, outside of the source tree. On CI the action
+# is usually checked out fresh, so the cache is disabled there unless TASK_CACHE=true.
+TASK_CACHE = os.environ.get("TASK_CACHE", "false" if "CI" in os.environ or "GITHUB_ACTIONS" in os.environ else "true") != "false"
+task_cache = os.path.expanduser("~/.cache/renode-linux-runner-action/tasks")
+
+
+def read_task_file(path: str) -> Task:
+    """
+    Loads a Task from a YAML file. If TASK_CACHE is enabled, the parsed description is stored
+    in a JSON file in `task_cache`, with a hash of the YAML file, and reused while the hash matches.
+
+    Parameters
+    ----------
+    path: path to the YAML file
+    """
+
+    cache = os.path.join(task_cache, f"{hashlib.sha256(os.path.abspath(path).encode()).hexdigest()}.json")
+
+    with open(path, "rb") as task_file:
+        content = task_file.read()
+
+    # mtime is not reliable, moved files keep it, so the cache is validated by the content
+    digest = hashlib.sha256(content).hexdigest()
+
+    if TASK_CACHE:
+        try:
+            with open(cache) as cache_file:
+                cached = json.load(cache_file)
+            if cached["sha256"] == digest:
+                return Task.load_from_object(cached["task"])
+        except (OSError, ValueError, KeyError, TypeError):
+            # missing, damaged or outdated cache, the YAML file is parsed again
+            pass
+
+    obj = Task.parse_yaml(content.decode())
+
+    if TASK_CACHE:
+        # the cache is written to a temporary file first, so it is never left half-written
+        tmp_path = None
+        try:
+            os.makedirs(task_cache, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=task_cache, suffix=".tmp")
+            with os.fdopen(fd, "w") as cache_file:
+                json.dump({"sha256": digest, "task": obj}, cache_file)
+            os.replace(tmp_path, cache)
+        except (OSError, TypeError):
+            # the cache is only an optimization, ignore unwritable directories
+            # and descriptions that contain values that cannot be stored in JSON
+            if tmp_path is not None:
+                with suppress(OSError):
+                    os.remove(tmp_path)
+
+    return Task.load_from_object(obj)
 
 
 class CommandDispatcher:
@@ -32,8 +94,8 @@ class CommandDispatcher:
     Stores Tasks and Shells, and provides functionalities to manage them
     """
 
-    tasks: Dict[str, Task] = {}
-    default_vars: Dict[str, str] = {}
+    tasks: Dict[str, Task]
+    default_vars: Dict[str, str]
 
     def __init__(self, board: str, global_vars: Dict[str, str], override_vars: Dict[str, Dict[str, str]]) -> None:
         """
@@ -43,6 +105,9 @@ class CommandDispatcher:
         override_vars: dictionary that stores a dictionary for each Task that overrides its existing variables
         """
 
+        self.tasks = {}
+        self.default_vars = {}
+
         # FilteredStdout is used to remove \r characters from telnet output.
         # GitHub workflow log GUI interprets this sequence as newline.
         self.default_stdout = FilteredStdout(sys.stdout, CR, "")
@@ -55,7 +120,7 @@ class CommandDispatcher:
             "renode": ["telnet 127.0.0.1 1234", self.default_stdout, [
                 Command(command="", expect="(monitor)", timeout=5),
                 Command(command="emulation CreateServerSocketTerminal 3456 \"term\"", expect="(monitor)", timeout=5),
-            ], 3, r"\([\-a-zA-Z\d\s]+\)"],
+            ], 3, RENODE_PROMPT],
             "target": ["telnet 127.0.0.1 3456", self.default_stdout, [], 0, "#"],
         }
 
@@ -76,16 +141,36 @@ class CommandDispatcher:
         override_vars: dictionary that stores different dictionaries for each task to override existing variables there
         """
 
-        for directory in ["action/tasks", f"action/device/{board}/tasks", "action/user_tasks"]:
-            if os.path.exists(directory):
-                for path, _, files in os.walk(directory):
-                    for f in files:
-                        fp = os.path.join(path, f)
-                        if fp.endswith((".yml", ".yaml")):
-                            with open(fp) as task_file:
-                                task = Task.load_from_yaml(task_file.read())
-                                task.apply_vars(self.default_vars, override_vars.get(task.name, {}))
-                                self.add_task(task)
+        task_files = [
+            fp
+            for directory in ["action/tasks", f"action/device/{board}/tasks", "action/user_tasks"]
+            for fp in sorted(self._find_task_files(directory))
+        ]
+
+        # Files are read and parsed concurrently, but the Tasks are added in a deterministic order
+        with ThreadPoolExecutor() as executor:
+            for task in executor.map(read_task_file, task_files):
+                task.apply_vars(self.default_vars, override_vars.get(task.name, {}))
+                self.add_task(task)
+
+    def _find_task_files(self, directory: str) -> Iterator[str]:
+        """
+        Yields paths of all YAML files in the directory and its subdirectories
+
+        Parameters
+        ----------
+        directory: directory to search, it is skipped if it does not exist
+        """
+
+        if not os.path.isdir(directory):
+            return
+
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from self._find_task_files(entry.path)
+                elif entry.is_file() and entry.name.endswith((".yml", ".yaml")):
+                    yield entry.path
 
     def _sort_tasks(self) -> None:
         """
@@ -93,25 +178,38 @@ class CommandDispatcher:
         It takes into account deleted tasks and detects cyclic dependencies.
         """
 
-        task_graph = ig.Graph(directed=True)
+        tasks = self.tasks
+        successors: Dict[str, list[str]] = {name: [] for name in tasks}
+        in_degree: Dict[str, int] = {name: 0 for name in tasks}
 
-        for name in self.tasks:
-            task_graph.add_vertex(name)
+        def add_edge(source: str, target: str) -> None:
+            successors[source].append(target)
+            in_degree[target] += 1
 
-        for name, task in self.tasks.items():
+        for name, task in tasks.items():
             for dependency in task.requires:
-                if dependency not in self.tasks.keys():
+                if dependency not in tasks:
                     error(f"Dependency {dependency} for {name} not satisfied. No such task.")
-                task_graph.add_edge(dependency, name)
+                add_edge(dependency, name)
 
             for dependency in task.before:
-                if dependency in self.tasks.keys():
-                    task_graph.add_edge(name, dependency)
+                if dependency in tasks:
+                    add_edge(name, dependency)
 
-        try:
-            results = task_graph.topological_sorting(mode='out')
-            sorted_tasks = [task_graph.vs[i]["name"] for i in results]
-        except ig.InternalError:
+        # Kahn's algorithm, Tasks without dependencies are processed in the order they were added
+        ready = deque(name for name, degree in in_degree.items() if degree == 0)
+        sorted_tasks = []
+
+        while ready:
+            name = ready.popleft()
+            sorted_tasks.append(name)
+
+            for successor in successors[name]:
+                in_degree[successor] -= 1
+                if in_degree[successor] == 0:
+                    ready.append(successor)
+
+        if len(sorted_tasks) != len(tasks):
             error("Cyclic dependencies detected. Aborting.")
 
         self.sorted_tasks = sorted_tasks
@@ -179,9 +277,10 @@ class CommandDispatcher:
                 continue
 
             exit_code = 0
-            self.shells[task.shell].add_task(task)
+            shell = self.shells[task.shell]
+            shell.add_task(task)
 
-            for return_code in self.shells[task.shell].run_step():
+            for return_code in shell.run_step():
                 if return_code != 0:
                     exit_code = return_code
                 if exit_code != 0 and task.fail_fast:
@@ -14,7 +14,8 @@
 
 from common import get_file, error, archs
 
-from subprocess import run, DEVNULL, CalledProcessError
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import run, Popen, DEVNULL, PIPE, CalledProcessError
 from dataclasses import dataclass
 
 import os
@@ -22,6 +23,7 @@ import re
 import sys
 import json
 import shutil
+import posixpath
 import tarfile
 import requests
 import dockersave
@@ -35,24 +37,78 @@ class shared_directories_action:
 
 shared_directories_actions: list[shared_directories_action] = []
 
+# magic numbers of compressed docker layers and tar options to extract them
+layer_compressions: dict[bytes, list[str]] = {
+    b"\x1f\x8b": ["-z"],
+    b"\xfd7zXZ\x00": ["-J"],
+    b"\x28\xb5\x2f\xfd": ["--zstd"],
+    b"BZh": ["-j"],
+}
+
 
 def docker_image_parse(image: str) -> tuple[str]:
 
-    result = re.match(r"^(.*)\/(.*):(.*)$", image)
-    if result:
-        return (result.group(1), result.group(2), result.group(3))
+    # library/image:tag, library/image, image:tag or image, the tag follows the last colon
+    # and the library precedes the last slash before it
+    colon = image.rfind(":")
+
+    slash = image.rfind("/", 0, colon) if colon != -1 else -1
+    if slash != -1:
+        return (image[:slash], image[slash + 1:colon], image[colon + 1:])
 
-    result = re.match(r"^(.*)\/(.*)$", image)
-    if result:
-        return (result.group(1), result.group(2), "latest")
+    slash = image.rfind("/")
+    if slash != -1:
+        return (image[:slash], image[slash + 1:], "latest")
 
-    result = re.match(r"^(.*):(.*)$", image)
-    if result:
-        return ("library", result.group(1), result.group(2))
+    if colon != -1:
+        return ("library", image[:colon], image[colon + 1:])
 
     return ("library", image, "latest")
 
 
+def extract_tar(archive: str, destination: str):
+    """
+    Extracts the archive with the native tar, which is much faster than the tarfile module for large archives.
+    The compression is detected by tar. When extracting fails, it exits from the script with the same error code as tar.
+
+    Parameters
+    ----------
+    archive: str
+        path to the tar archive
+    destination: str
+        directory to extract the archive to, it is created if it does not exist
+    """
+
+    os.makedirs(destination, exist_ok=True)
+
+    try:
+        run(["tar", "-xf", archive, "-C", destination], check=True)
+    except CalledProcessError as e:
+        sys.exit(e.returncode)
+
+
+def copy_directory(source: str, destination: str):
+    """
+    Copies the directory content with rsync, which is much faster than shutil.copytree for trees with many small files.
+    Like shutil.copytree, it follows symlinks and does not copy file owners. If rsync is not installed, shutil.copytree is used.
+    When copying fails, it exits from the script with the same error code as rsync.
+
+    Parameters
+    ----------
+    source: str
+        directory to copy
+    destination: str
+        target directory, it is merged with the source if it exists
+    """
+
+    try:
+        run(["rsync", "-a", "--copy-links", "--no-owner", "--no-group", f"{source}/", f"{destination}/"], check=True)
+    except FileNotFoundError:
+        shutil.copytree(source, destination, dirs_exist_ok=True)
+    except CalledProcessError as e:
+        sys.exit(e.returncode)
+
+
 def prepare_shared_directories(shared_directories: str):
     """
     Creates list of directories to share
@@ -63,27 +119,91 @@ def prepare_shared_directories(shared_directories: str):
         list of directories that the user wanted to share with emulated Linux
     """
 
-    global shared_directories_actions
+    for directory in shared_directories.splitlines():
+        host, separator, target = directory.partition(' ')
 
-    shared_directories: list[list[str]] = [directory.split(' ') for directory in shared_directories.split('\n')]
-
-    for directory in shared_directories:
-        if len(directory) == 1 and directory[0] != '':
+        if separator:
             shared_directories_actions.append(
                 shared_directories_action(
-                    directory[0],
-                    '/home',
+                    host,
+                    target.partition(' ')[0],
                 )
             )
-        elif len(directory) > 1:
+        elif host != '':
             shared_directories_actions.append(
                 shared_directories_action(
-                    directory[0],
-                    directory[1],
+                    host,
+                    '/home',
                 )
             )
 
 
+def extract_docker_layer(docker_image: str, destination: str):
+    """
+    Extracts the first layer of the saved docker image. The layer is streamed from the image
+    straight to the native tar, without writing it to disk first. When extracting fails,
+    it exits from the script with the same error code as tar.
+
+    Parameters
+    ----------
+    docker_image: str
+        path to the docker image saved as a tar archive
+    destination: str
+        directory to extract the layer to, it is created if it does not exist
+    """
+
+    os.makedirs(destination, exist_ok=True)
+
+    with tarfile.open(docker_image) as image_tar:
+        # member names may start with "./"
+        members = {os.path.normpath(member.name): member for member in image_tar.getmembers()}
+
+        manifest = json.load(image_tar.extractfile(members["manifest.json"]))
+        layer = image_tar.extractfile(members[os.path.normpath(manifest[0]['Layers'][0])])
+
+        # tar detects compression only in files, so it is detected here from the magic number
+        magic = layer.read(6)
+        compression = next((option for prefix, option in layer_compressions.items() if magic.startswith(prefix)), [])
+
+        try:
+            with Popen(["tar", "-x", *compression, "-f", "-", "-C", destination], stdin=PIPE) as tar:
+                tar.stdin.write(magic)
+                shutil.copyfileobj(layer, tar.stdin, 1024**2)
+        except BrokenPipeError:
+            # tar exited before reading the whole layer, Popen still waits for it,
+            # so its error code is checked below
+            pass
+
+    if tar.returncode != 0:
+        sys.exit(tar.returncode)
+
+
+def shared_directories_groups(actions: list[shared_directories_action]) -> list[list[shared_directories_action]]:
+    """
+    Splits directories to share into groups, which can be copied concurrently. Directories with the same
+    or nested targets are in the same group, in their original order, so later ones still overwrite earlier ones.
+
+    Parameters
+    ----------
+    actions: list[shared_directories_action]
+        directories to share
+    """
+
+    def overlapping(a: str, b: str) -> bool:
+        # POSIX keeps two leading slashes in normpath, so they are stripped first
+        a, b = posixpath.normpath("/" + a.lstrip("/")), posixpath.normpath("/" + b.lstrip("/"))
+        return a == b or a.startswith(f"{b.rstrip('/')}/") or b.startswith(f"{a.rstrip('/')}/")
+
+    groups: list[list[shared_directories_action]] = []
+
+    for action in actions:
+        overlapping_groups = [group for group in groups if any(overlapping(action.target, dir.target) for dir in group)]
+        groups = [group for group in groups if group not in overlapping_groups]
+        groups.append([dir for group in overlapping_groups for dir in group] + [action])
+
+    return groups
+
+
 def prepare_kernel_and_initramfs(kernel: str):
     """
     Get the kernel package (kernel + initramfs + bootlader + firmware) and extract kernel and device tree from cpio archive.
@@ -94,12 +214,11 @@ def prepare_kernel_and_initramfs(kernel: str):
         path or URL to the kernel package
     """
 
-    get_file(kernel, "kernel.tar.xz")
+    get_file(kernel, "kernel.tar.xz", use_cache=True)
 
     os.makedirs("images")
 
-    with tarfile.open("kernel.tar.xz") as tar:
-        tar.extractall("images")
+    extract_tar("kernel.tar.xz", "images")
 
     if not os.path.exists("images/Image") and not os.path.exists("images/vmlinux"):
         error("Kernel not found! Action expects Image or vmlinux file.")
@@ -123,18 +242,24 @@ def rootfs_size(size_str: str) -> int:
     }
 
     if size_str == "auto" or size_str.startswith("+"):
-        size = 0
-        for path, _, files in os.walk("images/rootfs"):
-            for f in files:
-                fp = os.path.join(path, f)
-                if not os.path.islink(fp):
-                    size += os.path.getsize(fp)
+        # apparent size of the extracted rootfs in bytes
+        size = int(run(["du", "-sb", "images/rootfs"], check=True, capture_output=True, text=True).stdout.split()[0])
 
         additional_size = int(size_str[:-1]) * units[size_str[-1]] if size_str.startswith("+") and size_str[-1] in units else 0
         return max(size * 2, 5 * 10**7) + additional_size
     return int(size_str)
 
 
+def mkfs_version() -> tuple[int, ...]:
+    """
+    Returns the version of e2fsprogs, which provide mkfs.ext4
+    """
+
+    version = re.search(r"mke2fs (\d+)\.(\d+)", run(["mkfs.ext4", "-V"], capture_output=True, text=True).stderr)
+
+    return tuple(int(i) for i in version.groups()) if version else (0,)
+
+
 def burn_rootfs_image(
         user_directory: str,
         image: str,
@@ -162,7 +287,7 @@ def burn_rootfs_image(
 
     if image_type == "native":
         get_file(image, "rootfs.tar.xz")
-        image = "rootfs.tar.xz"
+        extract_tar("rootfs.tar.xz", "images/rootfs")
     elif image_type == "docker":
         library, image, tag = docker_image_parse(image)
 
@@ -192,33 +317,34 @@ def burn_rootfs_image(
             tarname="docker-image.tar"
         )
 
-        with tarfile.open("images/docker-image.tar") as tar:
-            tar.extractall("images/docker-image")
-
-        with open('images/docker-image/manifest.json') as manifest_f:
-            manifest = json.loads(manifest_f.read())
-
-        selected_layer = manifest[0]['Layers'][0]
-
-        image = f"images/docker-image/{selected_layer}"
+        extract_docker_layer("images/docker-image.tar", "images/rootfs")
     else:
         error(f"image type: {image_type} not found")
 
-    with tarfile.open(image) as tar:
-        tar.extractall("images/rootfs")
+    def copy_shared_directories(group: list[shared_directories_action]):
+        for dir in group:
+            os.makedirs(f"images/rootfs/{dir.target}", exist_ok=True)
+            copy_directory(
+                f"{user_directory}/{dir.host}" if not dir.host.startswith('/') else dir.host,
+                f"images/rootfs/{dir.target}"
+            )
 
-    for dir in shared_directories_actions:
-        os.makedirs(f"images/rootfs/{dir.target}", exist_ok=True)
-        shutil.copytree(
-            f"{user_directory}/{dir.host}" if not dir.host.startswith('/') else dir.host,
-            f"images/rootfs/{dir.target}",
-            dirs_exist_ok=True
-        )
+    # groups with separate targets are copied concurrently
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(copy_shared_directories, shared_directories_groups(shared_directories_actions)))
 
     try:
         run(["truncate", "images/rootfs.img", "-s", f"{rootfs_size(image_size)}"], check=True)
-        run(["mkfs.ext4", "-d", "images/rootfs", "images/rootfs.img"],
+        # the image is a new sparse file that already reads as zeros, so mkfs does not need to zero
+        # the inode tables and the journal, which keeps the image sparse and spares the emulated
+        # kernel from zeroing them lazily after mounting
+        extended_options = ["-E", "assume_storage_prezeroed=1"] if mkfs_version() >= (1, 47) else []
+        run(["mkfs.ext4", *extended_options, "-d", "images/rootfs", "images/rootfs.img"],
             check=True,
             stdout=DEVNULL)
     except CalledProcessError as e:
         sys.exit(e.returncode)
+
+    # the extracted trees are in the image now, removing them frees the runner's disk
+    # and page cache for the emulation
+    shutil.rmtree("images/rootfs")
@@ -16,7 +16,7 @@ from command import Task
 from common import get_file, error, archs
 from devices import add_devices
 from dependencies import add_repos, add_packages
-from images import prepare_shared_directories, prepare_kernel_and_initramfs, burn_rootfs_image, shared_directories_actions
+from images import prepare_shared_directories, prepare_kernel_and_initramfs, burn_rootfs_image, copy_directory, shared_directories_actions
 from dispatcher import CommandDispatcher
 from subprocess import run
 
@@ -25,7 +25,6 @@ from datetime import datetime
 import sys
 import json
 import yaml
-import shutil
 import os
 
 
@@ -113,7 +112,7 @@ if __name__ == "__main__":
     prepare_shared_directories(args.get("shared-dirs", ""))
 
     devices = add_devices(args.get("devices", ""))
-    python_packages = add_packages(arch, args.get("python-packages", ""))
+    python_packages = add_packages(arch, args.get("python-packages", ""), f"{user_directory}/.pip-wheel-cache")
 
     optional_tasks = devices | python_packages
 
@@ -157,4 +156,4 @@ if __name__ == "__main__":
         src = f"rootfs/{dir.target}"
         dst = f"{user_directory}/{dir.host}" if not dir.host.startswith('/') else dir.host
         if os.path.exists(src):
-            shutil.copytree(src, dst, dirs_exist_ok=True)
+            copy_directory(src, dst)
@@ -12,22 +12,42 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from common import error
+from common import error, is_literal
 from command import Command, Task
 
+from collections import deque
+from functools import lru_cache
 from typing import Iterator, TextIO
 from time import sleep
 
-import queue
+import re
 import pexpect as px
 
 
+@lru_cache(maxsize=None)
+def compile_expect(pattern: str) -> list[re.Pattern] | None:
+    """
+    pexpect compiles regex patterns on every expect call, so they are compiled here once
+    and shared by all Shells, the same way as pexpect's compile_pattern_list does it.
+    Returns None for literal patterns.
+
+    Parameters
+    ----------
+    pattern: expected pattern
+    """
+
+    return None if is_literal(pattern) else [re.compile(pattern, re.DOTALL)]
+
+
 class Shell:
     """
     pexpect.spawn wrapper with additional configuration.
     Collects Command objects and runs them sequentially.
     """
 
+    result_pattern = re.compile(r"RESULT:(\d+)")
+    read_size = 16384
+
     def __init__(self, name: str, spawn_cmd: str, stdout: TextIO, commands: list[Command], default_expect: str) -> None:
 
         """
@@ -38,7 +58,7 @@ class Shell:
         stdout: if the command is executed in echo mode, the output is redirected to this TextIO
         commands: adds these initial commands to queue
         """
-        self.queue: queue.Queue[Command] = queue.Queue()
+        self.queue: deque[Command] = deque()
         self.name: str = name
         self.spawn_cmd: str = spawn_cmd
         self.child: px.spawn = None
@@ -56,10 +76,17 @@ class Shell:
 
         while retries > 0:
             try:
+                # Bound the part of the buffer that is searched for the expected patterns, so long outputs
+                # are not rescanned on every read. The window is not smaller than a single read, so a
+                # pattern in freshly read data is never skipped. poll() is used instead of select(), which
+                # cannot wait on descriptors above FD_SETSIZE.
                 self.child = px.spawn(
                     self.spawn_cmd,
                     encoding="utf-8",
-                    timeout=None
+                    timeout=None,
+                    maxread=self.read_size,
+                    searchwindowsize=self.read_size,
+                    use_poll=True
                 )
 
             except px.EOF:
@@ -73,13 +100,27 @@ class Shell:
 
         error(f"Shell {self.name} is not responding")
 
+    def _set_echo(self, echo: bool) -> None:
+        """
+        Redirects the Shell output to stdout if echo is enabled. The pexpect logfile is only
+        replaced when the echo mode changes.
+        """
+        logfile = self.stdout if echo else None
+
+        if self.child.logfile_read is not logfile:
+            self.child.logfile_read = logfile
+
     def _expect(self, command: Command) -> None:
-        self.child.expect(command.expect, timeout=command.timeout)
+        # Literal patterns, like most prompts, are matched with the faster expect_exact.
+        patterns = compile_expect(command.expect)
 
-    def _sendline(self, command: Command) -> None:
-        if command.command == []:
-            return
+        if patterns is None:
+            self.child.expect_exact(command.expect, timeout=command.timeout)
+        else:
+            self.child.expect_list(patterns, timeout=command.timeout)
 
+    def _sendline(self, command: Command) -> None:
+        # Empty commands are sent too, the newline makes the Shell print its prompt again
         self.child.sendline(command.command)
 
     def _add_command(self, command: Command) -> None:
@@ -91,18 +132,16 @@ class Shell:
         command: command
         """
 
-        self.queue.put(command)
+        self.queue.append(command)
 
     def add_task(self, task: Task) -> None:
 
-        for command in task.commands:
-
-            command._apply_task_properties(
-                ["timeout", "expect", "echo", "check_exit_code", "should_fail"],
-                [-1, None, None, None, None],
-                [task.timeout, self.default_expect, task.echo, task.check_exit_code, task.should_fail]
-            )
+        properties = ["timeout", "expect", "echo", "check_exit_code", "should_fail"]
+        defaults = [-1, None, None, None, None]
+        task_values = [task.timeout, self.default_expect, task.echo, task.check_exit_code, task.should_fail]
 
+        for command in task.commands:
+            command._apply_task_properties(properties, defaults, task_values)
             self._add_command(command)
 
     def run_step(self) -> Iterator[int]:
@@ -110,17 +149,19 @@ class Shell:
         Runs single command from queue per iteration and yields its error code
         """
 
+        # Renode monitor commands do not have exit codes
+        shell_exit_codes = self.name not in ["renode"]
+
         def return_code(command: Command):
 
-            if self.name in ["renode"] or not command.check_exit_code:
+            if not shell_exit_codes or not command.check_exit_code:
                 return 0
 
-            self.child.logfile_read = None
+            self._set_echo(False)
             self.child.sendline("echo RESULT:${?}")
-            self.child.expect(r"RESULT:(\d+)", timeout=10)
+            self.child.expect(self.result_pattern, timeout=10)
             ret = int(self.child.match.group(1))
             self.child.expect_exact(self.default_expect, timeout=10)
-            self.child.logfile_read = self.stdout if command.echo else None
 
             if command.should_fail:
                 ret = int(ret == 0)
@@ -130,10 +171,10 @@ class Shell:
         if not self.child:
             self._spawn()
 
-        while not self.queue.empty():
+        while self.queue:
 
-            command = self.queue.get()
-            self.child.logfile_read = self.stdout if command.echo else None
+            command = self.queue.popleft()
+            self._set_echo(command.echo)
 
             try:
                 self._sendline(command)
@@ -146,4 +187,4 @@ class Shell:
             except px.EOF:
                 error(f"Shell {self.name} is not responding")
             except px.TIMEOUT:
-                error(f"Timeout! (shell={self.name}, cmd={''.join(command.command)})")
+                error(f"Timeout! (shell={self.name}, cmd={command.command})")